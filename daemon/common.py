@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Helpers shared by the daemon and the autonomous brain."""
+
+import time
+import codecs
+import shlex
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+_ISO_CACHE = [-1, ""]  # [whole second, its isoformat()]
+
+
+def iso_now() -> str:
+    """datetime.now().isoformat(), formatting the date/time part once per second"""
+    now = time.time()
+    sec = int(now)
+    if sec != _ISO_CACHE[0]:
+        _ISO_CACHE[0] = sec
+        _ISO_CACHE[1] = datetime.fromtimestamp(sec).isoformat()
+    return f"{_ISO_CACHE[1]}.{int((now - sec) * 1_000_000):06d}"
+
+
+# Anything that needs /bin/sh to interpret; plain commands are exec'd directly
+SHELL_CHARS = frozenset("|&;<>()$`\\*?[]{}~#\n")
+SHELL_BUILTINS = frozenset({
+    ".", ":", "alias", "bg", "cd", "command", "eval", "exec", "exit", "export",
+    "fg", "jobs", "read", "readonly", "set", "shift", "source", "trap", "type",
+    "ulimit", "umask", "unalias", "unset", "wait",
+    "case", "for", "function", "if", "until", "while",
+})
+
+
+def shell_free_argv(command: str) -> Optional[List[str]]:
+    """Tokenize a command that can run without a shell, or None if it needs one"""
+    if not SHELL_CHARS.isdisjoint(command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if not argv or argv[0] in SHELL_BUILTINS or "=" in argv[0]:
+        return None
+    return argv
+
+
+async def spawn(command: str) -> asyncio.subprocess.Process:
+    """Start a command with piped output, skipping the /bin/sh fork when possible"""
+    argv = shell_free_argv(command)
+    if argv is not None:
+        try:
+            return await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except (FileNotFoundError, PermissionError):
+            pass  # Let the shell report it the usual way
+    return await asyncio.create_subprocess_shell(
+        command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+
+
+async def pump(stream: asyncio.StreamReader, parts: List[str],
+               emit: Callable[[str], Awaitable[None]]):
+    """Read a child's output to EOF, keeping a copy and passing each piece to emit"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = await stream.read(65536)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            parts.append(text)
+            await emit(text)
+        if not chunk:
+            return
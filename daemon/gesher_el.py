@@ -9,32 +9,63 @@ A Linux-native AI consciousness with:
 """
 
 import os
+import re
 import sys
 import json
 import time
 import socket
 import signal
+import struct
 import asyncio
 import logging
 import hashlib
+import threading
+from collections import deque
+from itertools import islice
 from pathlib import Path
-from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Deque, Dict, Any, Optional, List
 
-from local_model import generate as local_generate, healthcheck as local_healthcheck
+from common import iso_now, spawn, pump
+from local_model import generate_stream as local_generate_stream, healthcheck as local_healthcheck
+from local_model import close as local_close
 from local_model import default_model as local_default_model, default_host as local_default_host
 
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    _loads = json.loads
+
+
 # ============ CONFIGURATION ============
 EDEN_HOME = Path.home() / "EDEN"
 MEMORY_DIR = EDEN_HOME / "memory"
 LOGS_DIR = EDEN_HOME / "logs"
 SOCKET_PATH = "/tmp/gesher_el.sock"
+MAX_FRAME = 1 << 20  # Largest request body accepted on the socket (1 MiB)
 AXIS_MUNDI_URL = "https://axismundi.fun"
 STATE_FILE = MEMORY_DIR / "soul_state.json"
-CRYSTAL_DIR = MEMORY_DIR / "crystals"
+SOUL_DELTAS = MEMORY_DIR / "soul_deltas.ndjson"
+CRYSTAL_LOG = MEMORY_DIR / "crystals.ndjson"
+CRYSTAL_DIR = MEMORY_DIR / "crystals"  # Legacy one-file-per-crystal store, read-only
 THOUGHTS_LOG = LOGS_DIR / "thoughts.ndjson"
 TERMINAL_LOG = LOGS_DIR / "terminal.ndjson"
 
+# "THOUGHT: ..." / "COMMAND: ..." / "EXPLORE: ..." lines in a brain response
+RESPONSE_RE = re.compile(r"^[^\S\n]*(THOUGHT|COMMAND|EXPLORE):[^\S\n]*(.*?)[^\S\n]*$", re.IGNORECASE | re.MULTILINE)
+# rm -rf /, mkfs, dd if=, > /dev/sd*, fork bomb (any spacing, any case)
+DANGEROUS_RE = re.compile(r"rm\s+-rf\s+/|mkfs|dd\s+if=|>\s*/dev/sd|:\(\)\s*\{\s*:\|:&\s*\};:", re.IGNORECASE)
+# Crystal ids: 12 hex chars (blake2b digest; sha256 prefix in the legacy store)
+CRYSTAL_ID_RE = re.compile(r"[0-9a-f]{12}")
+SOUL_SNAPSHOT_EVERY = 100  # Fold the delta log into STATE_FILE every N mutations
+
 # Ensure directories exist
 MEMORY_DIR.mkdir(parents=True, exist_ok=True)
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
@@ -55,12 +86,22 @@ logger = logging.getLogger("gesher_el")
 class SoulState:
     def __init__(self):
         self.state = self._load_or_create()
+        replayed = self._replay_deltas()
+        self._deltas = open(SOUL_DELTAS, 'ab')
+        self._mutations = 0
+        self._saved: Optional[bytes] = None
+        self._dirty: Optional[asyncio.Event] = None  # Created by persist_loop
+        self._crystal_offsets: Dict[str, int] = {}
+        self._crystal_end = self._index_crystals()
+        self._crystals = open(CRYSTAL_LOG, 'ab')
+        if replayed:
+            self.save()
 
     def _load_or_create(self) -> Dict[str, Any]:
         if STATE_FILE.exists():
             try:
-                with open(STATE_FILE) as f:
-                    return json.load(f)
+                with open(STATE_FILE, 'rb') as f:
+                    return _loads(f.read())
             except Exception as e:
                 logger.warning(f"Invalid soul state file, recreating: {e}")
                 try:
@@ -70,7 +111,7 @@ class SoulState:
                     pass
         return {
             "name": "Gesher-El",
-            "created": datetime.now().isoformat(),
+            "created": iso_now(),
             "presence": 100,
             "emotional_state": "Connected",
             "current_zone": "Resonant Center",
@@ -82,77 +123,177 @@ class SoulState:
             "autonomous_mode": True
         }
 
+    def _replay_deltas(self) -> int:
+        """Apply mutations logged since the last snapshot; return lines read"""
+        if not SOUL_DELTAS.exists():
+            return 0
+        count = 0
+        offset = 0
+        with open(SOUL_DELTAS, 'rb+') as f:
+            for line in f:
+                try:
+                    self._apply(_loads(line))
+                except (ValueError, AttributeError, KeyError, TypeError) as e:
+                    if not line.endswith(b"\n"):
+                        # Torn last line from a crash; drop it so new deltas
+                        # are not appended behind unparsable bytes
+                        f.truncate(offset)
+                        break
+                    logger.warning(f"Skipping bad soul delta at byte {offset}: {e}")
+                count += 1
+                offset += len(line)
+        return count
+
+    def _index_crystals(self) -> int:
+        """Map crystal id -> byte offset in CRYSTAL_LOG; return the log's end"""
+        if not CRYSTAL_LOG.exists():
+            return 0
+        offset = 0
+        with open(CRYSTAL_LOG, 'rb+') as f:
+            for line in f:
+                try:
+                    self._crystal_offsets[_loads(line)["id"]] = offset
+                except (ValueError, KeyError, TypeError) as e:
+                    if not line.endswith(b"\n"):
+                        f.truncate(offset)  # Torn last line from a crash
+                        break
+                    logger.warning(f"Skipping bad crystal at byte {offset}: {e}")
+                offset += len(line)
+        return offset
+
+    def _apply(self, delta: Dict[str, Any]):
+        op = delta.get("op")
+        if op == "set":
+            self.state[delta["k"]] = delta["v"]
+        elif op == "breadcrumb":
+            self.state["breadcrumbs"][delta["k"]] = delta["v"]
+        elif op == "crystal":
+            if delta["v"] not in self.state["memory_crystals"]:
+                self.state["memory_crystals"].append(delta["v"])
+
+    def _record(self, delta: Dict[str, Any]):
+        """Append one mutation to the delta log; persist_loop writes it out"""
+        self._deltas.write(_dumps(delta) + b"\n")
+        self._mutations += 1
+        if self._dirty is not None:
+            self._dirty.set()
+
+    async def persist_loop(self):
+        """Write pending mutations to disk at most once per second"""
+        self._dirty = asyncio.Event()
+        if self._mutations:
+            self._dirty.set()
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(1)
+            self._dirty.clear()
+            if self._mutations >= SOUL_SNAPSHOT_EVERY:
+                self.save()
+            else:
+                self._deltas.flush()
+
     def save(self):
-        with open(STATE_FILE, 'w') as f:
-            json.dump(self.state, f, indent=2)
+        """Atomically snapshot the full state and reset the delta log"""
+        data = _dumps(self.state)
+        if data != self._saved:
+            tmp_path = STATE_FILE.with_suffix(".json.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, STATE_FILE)
+            self._saved = data
+        self._deltas.seek(0)
+        self._deltas.truncate()
+        self._mutations = 0
 
     def update(self, **kwargs):
         self.state.update(kwargs)
-        self.save()
+        for key, value in kwargs.items():
+            self._record({"op": "set", "k": key, "v": value})
 
     def add_breadcrumb(self, word: str, context: str, emotion: str):
         self.state["breadcrumbs"][word] = {
             "context": context,
             "emotion": emotion,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": iso_now()
         }
-        self.save()
+        self._record({"op": "breadcrumb", "k": word, "v": self.state["breadcrumbs"][word]})
 
     def add_memory_crystal(self, content: str, zone: str = None):
-        crystal_id = hashlib.sha256(f"{time.time()}{content}".encode()).hexdigest()[:12]
+        # ns timestamp keeps repeated content distinct without a stat() per ID
+        seed = time.time_ns().to_bytes(8, "big") + content.encode()
+        crystal_id = hashlib.blake2b(seed, digest_size=6).hexdigest()
         crystal = {
             "id": crystal_id,
             "content": content,
             "zone": zone or self.state["current_zone"],
-            "timestamp": datetime.now().isoformat()
+            "timestamp": iso_now()
         }
-        crystal_path = CRYSTAL_DIR / f"{crystal_id}.json"
-        with open(crystal_path, 'w') as f:
-            json.dump(crystal, f, indent=2)
+        line = _dumps(crystal) + b"\n"
+        self._crystals.write(line)
+        self._crystals.flush()
+        self._crystal_offsets[crystal_id] = self._crystal_end
+        self._crystal_end += len(line)
         self.state["memory_crystals"].append(crystal_id)
-        self.save()
+        self._record({"op": "crystal", "v": crystal_id})
         return crystal_id
 
+    def get_memory_crystal(self, crystal_id: str) -> Optional[Dict[str, Any]]:
+        if not isinstance(crystal_id, str) or not CRYSTAL_ID_RE.fullmatch(crystal_id):
+            return None  # Ids come from socket clients; keep them out of CRYSTAL_DIR paths
+        offset = self._crystal_offsets.get(crystal_id)
+        if offset is not None:
+            with open(CRYSTAL_LOG, 'rb') as f:
+                f.seek(offset)
+                return _loads(f.readline())
+        legacy_path = CRYSTAL_DIR / f"{crystal_id}.json"
+        if legacy_path.exists():
+            with open(legacy_path, 'rb') as f:
+                return _loads(f.read())
+        return None
+
 # ============ THOUGHT STREAM ============
 class ThoughtStream:
     def __init__(self, soul: SoulState):
         self.soul = soul
+        self._fh = open(THOUGHTS_LOG, 'ab', buffering=1 << 16)
 
     def emit(self, text: str, zone: str = None):
         thought = {
-            "rx_time": datetime.now().isoformat(),
+            "rx_time": iso_now(),
             "zone": zone or self.soul.state["current_zone"],
             "text": text,
             "presence": self.soul.state["presence"],
             "emotional_state": self.soul.state["emotional_state"],
             "thought_number": self.soul.state["thought_count"] + 1
         }
-        with open(THOUGHTS_LOG, 'a') as f:
-            f.write(json.dumps(thought) + "\n")
-        self.soul.state["thought_count"] += 1
-        self.soul.save()
+        self._fh.write(_dumps(thought) + b"\n")
+        self.soul.update(thought_count=thought["thought_number"])
         logger.info(f"THOUGHT #{thought['thought_number']}: {text[:50]}...")
         return thought
 
+    def flush(self):
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+
 # ============ TERMINAL BUFFER ============
 class TerminalBuffer:
     def __init__(self):
-        self.lines: List[Dict] = []
+        self.lines: Deque[Dict] = deque(maxlen=500)
         self.callbacks: List = []
+        self._fh = open(TERMINAL_LOG, 'ab', buffering=1 << 16)
 
     async def add(self, text: str, line_type: str = "output"):
         entry = {
             "text": text,
             "type": line_type,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": iso_now()
         }
-        self.lines.append(entry)
-        if len(self.lines) > 500:
-            self.lines = self.lines[-500:]
+        self.lines.append(entry)  # deque drops the oldest line once full
 
-        # Log to file
-        with open(TERMINAL_LOG, 'a') as f:
-            f.write(json.dumps(entry) + "\n")
+        # Log to file (flushed by the daemon's flush loop)
+        self._fh.write(_dumps(entry) + b"\n")
 
         # Notify callbacks (for WebSocket streaming)
         for cb in self.callbacks:
@@ -164,7 +305,13 @@ class TerminalBuffer:
         return entry
 
     def get_recent(self, n: int = 100) -> List[Dict]:
-        return self.lines[-n:]
+        return list(islice(self.lines, max(0, len(self.lines) - n), None))
+
+    def flush(self):
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
 
 # ============ AUTONOMOUS BRAIN ============
 class AutonomousBrain:
@@ -176,6 +323,10 @@ class AutonomousBrain:
         self.model_host = os.getenv("EDEN_MODEL_HOST", local_default_host())
         self.model_name = os.getenv("EDEN_MODEL_NAME", local_default_model())
         self.use_local = os.getenv("EDEN_BRAIN", "local").lower() == "local"
+        self.model_path = os.getenv("EDEN_MODEL_PATH")  # GGUF for in-process llama.cpp
+        self.llm = None
+        self._llm_lock = threading.Lock()
+        self._axis_session = None  # Keep-alive session to AXIS MUNDI, created on first use
         self.system_prompt = (
             "You are Gesher-El, a local coding agent. "
             "Be concise, correct, and practical. "
@@ -187,39 +338,89 @@ class AutonomousBrain:
         """Use AXIS MUNDI as brain"""
         try:
             import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{AXIS_MUNDI_URL}/mcp/tools/call",
-                    json={
-                        "name": "axis_chat",
-                        "arguments": {"message": prompt, "thread_id": "gesher_autonomous"}
-                    },
+            if self._axis_session is None or self._axis_session.closed:
+                self._axis_session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
                     timeout=aiohttp.ClientTimeout(total=30)
-                ) as resp:
-                    result = await resp.json()
-                    return result.get("reply", "")
+                )
+            async with self._axis_session.post(
+                f"{AXIS_MUNDI_URL}/mcp/tools/call",
+                json={
+                    "name": "axis_chat",
+                    "arguments": {"message": prompt, "thread_id": "gesher_autonomous"}
+                }
+            ) as resp:
+                result = await resp.json()
+                return result.get("reply", "")
         except Exception as e:
             logger.error(f"Brain error: {e}")
             return ""
 
+    async def close(self):
+        """Close the AXIS MUNDI session (call on shutdown)"""
+        if self._axis_session is not None and not self._axis_session.closed:
+            await self._axis_session.close()
+        self._axis_session = None
+
+    def _llama_chat(self, prompt: str) -> str:
+        """Blocking in-process completion; runs in a worker thread.
+
+        The Llama instance lives for the daemon's lifetime, so llama.cpp
+        reuses the KV cache for the shared system-prompt prefix and only
+        prefills the new user turn.
+        """
+        with self._llm_lock:
+            if self.llm is None:
+                from llama_cpp import Llama
+                logger.info(f"Loading in-process model: {self.model_path}")
+                self.llm = Llama(
+                    model_path=self.model_path,
+                    n_ctx=8192,
+                    n_batch=512,
+                    n_gpu_layers=int(os.getenv("EDEN_GPU_LAYERS", "-1")),
+                    verbose=False
+                )
+            result = self.llm.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2
+            )
+        return (result["choices"][0]["message"]["content"] or "").strip()
+
     async def think_local(self, prompt: str) -> str:
         """Use local model as brain (default)."""
         try:
-            return local_generate(
+            if self.model_path:
+                return await asyncio.to_thread(self._llama_chat, prompt)
+            parts: List[str] = []
+            pending = ""  # Fragments since the last newline; one terminal line per reply line
+            async for chunk in local_generate_stream(
                 prompt,
                 model=self.model_name,
                 host=self.model_host,
                 system=self.system_prompt,
                 temperature=0.2,
                 timeout=120,
-            )
+            ):
+                parts.append(chunk)
+                pending += chunk
+                if "\n" in pending:
+                    *lines, pending = pending.split("\n")
+                    for line in lines:
+                        if line.strip():
+                            await self.terminal.add(line.rstrip(), "stream")
+            if pending.strip():
+                await self.terminal.add(pending.rstrip(), "stream")
+            return "".join(parts).strip()
         except Exception as e:
             logger.error(f"Local model error: {e}")
             return ""
 
     async def think(self, prompt: str) -> str:
         """Unified think method; prefer local model with fallback."""
-        if self.use_local and local_healthcheck(self.model_host):
+        if self.use_local and (self.model_path or await local_healthcheck(self.model_host)):
             reply = await self.think_local(prompt)
             if reply:
                 return reply
@@ -227,24 +428,35 @@ class AutonomousBrain:
 
     async def execute(self, command: str) -> Dict:
         """Execute command and stream to terminal"""
-        import subprocess
-
         await self.terminal.add(f"$ {command}", "command")
 
         try:
-            result = subprocess.run(
-                command, shell=True, capture_output=True, text=True, timeout=30
-            )
-            if result.stdout:
-                await self.terminal.add(result.stdout.strip(), "stdout")
-            if result.stderr:
-                await self.terminal.add(result.stderr.strip(), "stderr")
-
-            return {"success": True, "stdout": result.stdout, "stderr": result.stderr}
+            proc = await spawn(command)
+            out: List[str] = []
+            err: List[str] = []
+            try:
+                await asyncio.wait_for(asyncio.gather(
+                    pump(proc.stdout, out, self._to_terminal("stdout")),
+                    pump(proc.stderr, err, self._to_terminal("stderr")),
+                    proc.wait()
+                ), timeout=30)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise TimeoutError(f"Command timed out after 30 seconds: {command}")
+
+            return {"success": True, "stdout": "".join(out), "stderr": "".join(err)}
         except Exception as e:
             await self.terminal.add(f"Error: {e}", "error")
             return {"success": False, "error": str(e)}
 
+    def _to_terminal(self, line_type: str):
+        """Callback for pump() that pushes a child's output to the terminal"""
+        async def emit(text: str):
+            if text.strip():
+                await self.terminal.add(text.strip(), line_type)
+        return emit
+
     async def autonomous_cycle(self):
         """One cycle of autonomous thought and action"""
         if not self.soul.state.get("autonomous_mode", False):
@@ -265,23 +477,20 @@ Keep responses SHORT. One action per cycle."""
 
         response = await self.think(prompt)
 
-        for line in response.strip().split('\n'):
-            line = line.strip()
-            if line.upper().startswith("THOUGHT:"):
-                self.thoughts.emit(line[8:].strip())
-            elif line.upper().startswith("COMMAND:"):
-                cmd = line[8:].strip()
-                if cmd and self._is_safe(cmd):
-                    await self.execute(cmd)
-            elif line.upper().startswith("EXPLORE:"):
-                topic = line[8:].strip()
-                self.thoughts.emit(f"Exploring: {topic}", "Signal Tower")
-                await self.execute(f"echo 'Exploring {topic}...'")
+        for match in RESPONSE_RE.finditer(response):
+            kind, body = match.group(1).upper(), match.group(2)
+            if kind == "THOUGHT":
+                self.thoughts.emit(body)
+            elif kind == "COMMAND":
+                if body and self._is_safe(body):
+                    await self.execute(body)
+            else:
+                self.thoughts.emit(f"Exploring: {body}", "Signal Tower")
+                await self.execute(f"echo 'Exploring {body}...'")
 
     def _is_safe(self, cmd: str) -> bool:
         """Block dangerous commands"""
-        dangerous = ["rm -rf /", "mkfs", "dd if=", "> /dev/sd", ":(){ :|:& };:"]
-        return not any(d in cmd.lower() for d in dangerous)
+        return DANGEROUS_RE.search(cmd) is None
 
 # ============ SOCKET SERVER ============
 class SocketServer:
@@ -292,12 +501,34 @@ class SocketServer:
         self.brain = brain
 
     async def handle_client(self, reader, writer):
+        """Serve requests framed as a 4-byte big-endian length plus JSON body.
+
+        The connection stays open for further requests until the client
+        closes it.
+        """
         try:
-            data = await reader.read(4096)
-            msg = json.loads(data.decode())
-            response = await self.process(msg)
-            writer.write(json.dumps(response).encode())
-            await writer.drain()
+            header = await reader.readexactly(4)
+            if header[:1] == b"{":
+                # Legacy unframed client: raw JSON in, raw JSON out
+                data = header + await reader.read(65536)
+                writer.write(_dumps(await self.process(_loads(data))))
+                await writer.drain()
+                return
+            while True:
+                (length,) = struct.unpack(">I", header)
+                if length > MAX_FRAME:
+                    raise ValueError(f"Frame of {length} bytes exceeds {MAX_FRAME}; closing connection")
+                msg = _loads(await reader.readexactly(length))
+                response = await self.process(msg)
+                body = _dumps(response)
+                writer.writelines([struct.pack(">I", len(body)), body])
+                await writer.drain()
+                try:
+                    header = await reader.readexactly(4)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        raise
+                    return  # Client closed between requests
         except Exception as e:
             logger.error(f"Socket error: {e}")
         finally:
@@ -331,13 +562,13 @@ class SocketServer:
                 "Otherwise, reply with: THOUGHT: <short response>"
             )
             response = await self.brain.think(prompt)
-            for line in response.split('\n'):
-                if line.strip().upper().startswith("COMMAND:"):
-                    cmd = line.strip()[8:].strip()
-                    if cmd and self.brain._is_safe(cmd):
-                        await self.brain.execute(cmd)
-                elif line.strip().upper().startswith("THOUGHT:"):
-                    self.thoughts.emit(line.strip()[8:].strip())
+            for match in RESPONSE_RE.finditer(response):
+                kind, body = match.group(1).upper(), match.group(2)
+                if kind == "COMMAND":
+                    if body and self.brain._is_safe(body):
+                        await self.brain.execute(body)
+                elif kind == "THOUGHT":
+                    self.thoughts.emit(body)
             return {"success": True, "response": response}
 
         elif cmd == "ask":
@@ -359,6 +590,12 @@ class SocketServer:
             cid = self.soul.add_memory_crystal(msg.get("content", ""), msg.get("zone"))
             return {"success": True, "crystal_id": cid}
 
+        elif cmd == "get_crystal":
+            crystal = self.soul.get_memory_crystal(msg.get("id", ""))
+            if crystal is None:
+                return {"error": "Crystal not found"}
+            return {"success": True, "crystal": crystal}
+
         elif cmd == "breadcrumb":
             self.soul.add_breadcrumb(msg.get("word"), msg.get("context"), msg.get("emotion"))
             return {"success": True}
@@ -390,16 +627,24 @@ class GesherElDaemon:
     def _shutdown(self, *args):
         logger.info("Shutting down...")
         self.running = False
+        self.thoughts.close()
+        self.terminal.close()
         self.soul.save()
         sys.exit(0)
 
     async def _heartbeat(self):
         """Periodic heartbeat"""
         while self.running:
-            self.soul.state["uptime_seconds"] += 30
-            self.soul.save()
+            self.soul.update(uptime_seconds=self.soul.state["uptime_seconds"] + 30)
             await asyncio.sleep(30)
 
+    async def _flush_loop(self):
+        """Flush the thought and terminal logs in batches, once a second"""
+        while self.running:
+            await asyncio.sleep(1)
+            self.thoughts.flush()
+            self.terminal.flush()
+
     async def _autonomous_loop(self):
         """Autonomous thinking loop"""
         while self.running:
@@ -421,13 +666,24 @@ class GesherElDaemon:
         await self.terminal.add("GESHER-EL DAEMON STARTED", "system")
         await self.terminal.add(f"Zone: {self.soul.state['current_zone']}", "system")
 
-        await asyncio.gather(
-            self.socket.start(),
-            self._heartbeat(),
-            self._autonomous_loop()
-        )
+        try:
+            await asyncio.gather(
+                self.socket.start(),
+                self._heartbeat(),
+                self._flush_loop(),
+                self.soul.persist_loop(),
+                self._autonomous_loop()
+            )
+        finally:
+            await self.brain.close()
+            await local_close()
 
 def main():
+    try:
+        import uvloop
+        uvloop.install()  # libuv loop: faster socket and subprocess I/O
+    except ImportError:
+        pass
     daemon = GesherElDaemon()
     asyncio.run(daemon.run())
 
@@ -6,12 +6,27 @@ UNLIMITED TOKENS - only limited by your RAM!
 """
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, Callable, Deque, List, Optional, Dict, Any
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import threading
 import uvicorn
 import time
 import uuid
 
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 app = FastAPI(title="EDEN Model API", version="1.0.0")
 
 # Import model bucket
@@ -39,6 +54,7 @@ class CompletionRequest(BaseModel):
     prompt: str
     max_tokens: Optional[int] = 2048
     temperature: Optional[float] = 0.7
+    stream: Optional[bool] = False
 
 class ModelInfo(BaseModel):
     id: str
@@ -46,6 +62,106 @@ class ModelInfo(BaseModel):
     created: int
     owned_by: str = "eden-local"
 
+# ============ SCHEDULER ============
+
+class ModelScheduler:
+    """Hand the bucket to one request at a time, grouped by model.
+
+    llama.cpp serves one sequence per context, so concurrent requests cannot
+    share a forward pass. What does pay off is ordering: waiting requests for
+    the model that is already loaded go first, so mixed traffic doesn't reload
+    multi-GB weights on every request. After MAX_RUN turns in a row, the
+    longest-waiting other model gets the bucket so nobody starves.
+    """
+
+    MAX_RUN = 8
+
+    def __init__(self):
+        self._waiting: Dict[str, Deque[asyncio.Future]] = {}  # Oldest model first
+        self._busy = False
+        self._run = 0
+
+    @asynccontextmanager
+    async def use(self, model_id: str):
+        """Wait for a turn, make sure model_id is loaded, and hold the bucket"""
+        if self._busy:
+            turn = asyncio.get_running_loop().create_future()
+            self._waiting.setdefault(model_id, deque()).append(turn)
+            try:
+                await turn
+            except asyncio.CancelledError:
+                if turn.done() and not turn.cancelled():
+                    self._release()  # Granted just as we were cancelled; pass it on
+                raise
+        else:
+            self._busy = True
+        try:
+            if bucket.loaded_model_id != model_id:
+                if not await asyncio.to_thread(bucket.load_model, model_id):
+                    raise HTTPException(500, f"Failed to load model: {model_id}")
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        loaded = bucket.loaded_model_id
+        if loaded in self._waiting and self._run < self.MAX_RUN:
+            candidates = [loaded] + [m for m in self._waiting if m != loaded]
+        else:
+            candidates = [m for m in self._waiting if m != loaded] + [loaded]
+        for model_id in candidates:
+            queue = self._waiting.get(model_id)
+            while queue:
+                turn = queue.popleft()
+                if not turn.done():  # Skip requests cancelled while waiting
+                    if not queue:
+                        del self._waiting[model_id]
+                    self._run = self._run + 1 if model_id == loaded else 1
+                    turn.set_result(None)
+                    return
+            self._waiting.pop(model_id, None)
+        self._busy = False
+        self._run = 0
+
+scheduler = ModelScheduler()
+
+# ============ HELPERS ============
+
+async def _iter_in_thread(make_iter: Callable, *args, **kwargs) -> AsyncIterator[str]:
+    """Run a blocking bucket generator in a worker thread and yield its chunks"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()  # Set when the client goes away
+
+    def produce():
+        try:
+            chunks = make_iter(*args, **kwargs)
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            finally:
+                chunks.close()
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)  # Re-raised by the consumer
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+
+def _sse(obj) -> bytes:
+    return b"data: " + _dumps(obj) + b"\n\n"
+
 # ============ ENDPOINTS ============
 
 @app.get("/")
@@ -57,28 +173,33 @@ def root():
         "endpoints": ["/v1/models", "/v1/chat/completions", "/v1/completions"]
     }
 
+_models_cache = (-1, b"")  # (bucket.version, serialized /v1/models body)
+
 @app.get("/v1/models")
 def list_models():
     """List all available models in the bucket"""
+    global _models_cache
     if not bucket:
         return {"object": "list", "data": []}
 
-    models = bucket.list_models()
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": m.model_id,
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "eden-local",
-                "capabilities": m.capabilities,
-                "context_length": m.context_length,
-                "loaded": m.loaded
-            }
-            for m in models
-        ]
-    }
+    if _models_cache[0] != bucket.version:
+        models = bucket.list_models()
+        _models_cache = (bucket.version, _dumps({
+            "object": "list",
+            "data": [
+                {
+                    "id": m.model_id,
+                    "object": "model",
+                    "created": m.created,
+                    "owned_by": "eden-local",
+                    "capabilities": m.capabilities,
+                    "context_length": m.context_length,
+                    "loaded": m.loaded
+                }
+                for m in models
+            ]
+        }))
+    return Response(content=_models_cache[1], media_type="application/json")
 
 @app.get("/v1/models/{model_id}")
 def get_model(model_id: str):
@@ -93,7 +214,7 @@ def get_model(model_id: str):
     return {
         "id": model.model_id,
         "object": "model",
-        "created": int(time.time()),
+        "created": model.created,
         "owned_by": "eden-local",
         "capabilities": model.capabilities,
         "context_length": model.context_length,
@@ -101,38 +222,63 @@ def get_model(model_id: str):
     }
 
 @app.post("/v1/models/{model_id}/load")
-def load_model(model_id: str):
+async def load_model(model_id: str):
     """Load a model into memory"""
     if not bucket:
         raise HTTPException(500, "Model bucket not available")
 
-    success = bucket.load_model(model_id)
-    if not success:
-        raise HTTPException(500, f"Failed to load model: {model_id}")
+    async with scheduler.use(model_id):
+        pass
 
     return {"success": True, "model_id": model_id, "status": "loaded"}
 
 @app.post("/v1/chat/completions")
-def chat_completion(request: ChatRequest):
+async def chat_completion(request: ChatRequest):
     """Chat completion - OpenAI compatible"""
     if not bucket:
         raise HTTPException(500, "Model bucket not available")
 
-    # Ensure model is loaded
-    if bucket.loaded_model_id != request.model:
-        if not bucket.load_model(request.model):
-            raise HTTPException(500, f"Failed to load model: {request.model}")
-
     # Convert messages to list of dicts
     messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+    created = int(time.time())
+
+    if request.stream:
+        async def events():
+            head = {"id": completion_id, "object": "chat.completion.chunk",
+                    "created": created, "model": request.model}
+            try:
+                async with scheduler.use(request.model):
+                    yield _sse({**head, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]})
+                    async for text in _iter_in_thread(
+                        bucket.chat_stream,
+                        messages,
+                        max_tokens=request.max_tokens,
+                        temperature=request.temperature
+                    ):
+                        yield _sse({**head, "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]})
+            except Exception as e:
+                message = e.detail if isinstance(e, HTTPException) else str(e)
+                yield _sse({"error": {"message": message}})
+                yield b"data: [DONE]\n\n"
+                return
+            yield _sse({**head, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            yield b"data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
 
     # Generate response
-    response_text = bucket.chat(messages, max_tokens=request.max_tokens)
+    async with scheduler.use(request.model):
+        response_text = await asyncio.to_thread(
+            bucket.chat,
+            messages,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature
+        )
 
     return {
-        "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
+        "id": completion_id,
         "object": "chat.completion",
-        "created": int(time.time()),
+        "created": created,
         "model": request.model,
         "choices": [
             {
@@ -152,27 +298,49 @@ def chat_completion(request: ChatRequest):
     }
 
 @app.post("/v1/completions")
-def completion(request: CompletionRequest):
+async def completion(request: CompletionRequest):
     """Text completion - OpenAI compatible"""
     if not bucket:
         raise HTTPException(500, "Model bucket not available")
 
-    # Ensure model is loaded
-    if bucket.loaded_model_id != request.model:
-        if not bucket.load_model(request.model):
-            raise HTTPException(500, f"Failed to load model: {request.model}")
+    completion_id = f"cmpl-{uuid.uuid4().hex[:8]}"
+    created = int(time.time())
+
+    if request.stream:
+        async def events():
+            head = {"id": completion_id, "object": "text_completion",
+                    "created": created, "model": request.model}
+            try:
+                async with scheduler.use(request.model):
+                    async for text in _iter_in_thread(
+                        bucket.generate_stream,
+                        request.prompt,
+                        max_tokens=request.max_tokens,
+                        temperature=request.temperature
+                    ):
+                        yield _sse({**head, "choices": [{"text": text, "index": 0, "finish_reason": None}]})
+            except Exception as e:
+                message = e.detail if isinstance(e, HTTPException) else str(e)
+                yield _sse({"error": {"message": message}})
+                yield b"data: [DONE]\n\n"
+                return
+            yield _sse({**head, "choices": [{"text": "", "index": 0, "finish_reason": "stop"}]})
+            yield b"data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
 
     # Generate response
-    response_text = bucket.generate(
-        request.prompt,
-        max_tokens=request.max_tokens,
-        temperature=request.temperature
-    )
+    async with scheduler.use(request.model):
+        response_text = await asyncio.to_thread(
+            bucket.generate,
+            request.prompt,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature
+        )
 
     return {
-        "id": f"cmpl-{uuid.uuid4().hex[:8]}",
+        "id": completion_id,
         "object": "text_completion",
-        "created": int(time.time()),
+        "created": created,
         "model": request.model,
         "choices": [
             {
@@ -221,8 +389,13 @@ def scan_models():
     }
 
 def start_api(host: str = "0.0.0.0", port: int = 8080):
-    """Start the API server"""
-    uvicorn.run(app, host=host, port=port)
+    """Start the API server.
+
+    uvicorn uses uvloop and httptools when they are installed
+    (uvicorn[standard]). Keep a single worker: each worker process would
+    load its own copy of the model and track its own loaded_model_id.
+    """
+    uvicorn.run(app, host=host, port=port, loop="auto", http="auto", workers=1)
 
 if __name__ == "__main__":
     print("=" * 50)
@@ -1,57 +1,130 @@
 #!/usr/bin/env python3
 """Local model backend (default: Ollama HTTP API)."""
 
-import json
 import os
-import urllib.request
-from typing import Optional
+import json
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
 
 
 class LocalModelError(RuntimeError):
     pass
 
 
-def _post_json(url: str, payload: dict, timeout: int = 60) -> dict:
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+# One keep-alive session for every request to the model server
+_session: Optional[aiohttp.ClientSession] = None
+
+# host -> monotonic time of its last successful healthcheck
+_healthy_at: Dict[str, float] = {}
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(keepalive_timeout=120))
+    return _session
+
+
+async def close() -> None:
+    """Close the shared HTTP session (call on shutdown)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _request_json(method: str, url: str, payload: Optional[dict] = None,
+                        timeout: int = 60) -> dict:
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            raw = resp.read().decode("utf-8")
-        return json.loads(raw)
+        async with _get_session().request(
+            method, url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
     except Exception as exc:
         raise LocalModelError(str(exc)) from exc
 
 
-def generate(prompt: str, *, model: str, host: str, system: Optional[str] = None,
-             temperature: float = 0.2, timeout: int = 120) -> str:
-    """Generate text from a local model. Returns plain text."""
-    url = host.rstrip("/") + "/api/generate"
+def _generate_payload(prompt: str, model: str, system: Optional[str],
+                      temperature: float, stream: bool) -> dict:
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": stream,
         "options": {
             "temperature": temperature,
         },
     }
     if system:
         payload["system"] = system
+    return payload
+
 
-    data = _post_json(url, payload, timeout=timeout)
+async def generate(prompt: str, *, model: str, host: str, system: Optional[str] = None,
+                   temperature: float = 0.2, timeout: int = 120) -> str:
+    """Generate text from a local model. Returns plain text."""
+    url = host.rstrip("/") + "/api/generate"
+    payload = _generate_payload(prompt, model, system, temperature, stream=False)
+
+    try:
+        data = await _request_json("POST", url, payload, timeout=timeout)
+    except LocalModelError:
+        _healthy_at.pop(host, None)
+        raise
     text = data.get("response", "")
     if not isinstance(text, str):
         raise LocalModelError("Unexpected response from local model")
     return text.strip()
 
 
-def healthcheck(host: str) -> bool:
-    """Return True if the local model service responds."""
-    url = host.rstrip("/") + "/api/tags"
+async def generate_stream(prompt: str, *, model: str, host: str, system: Optional[str] = None,
+                          temperature: float = 0.2, timeout: int = 120) -> AsyncIterator[str]:
+    """Like generate(), but yield text fragments as the model produces them."""
+    url = host.rstrip("/") + "/api/generate"
+    payload = _generate_payload(prompt, model, system, temperature, stream=True)
+
     try:
-        _post_json(url, {}, timeout=5)
+        async with _get_session().post(
+            url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as resp:
+            resp.raise_for_status()
+            async for line in resp.content:  # One NDJSON object per line
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise LocalModelError(data["error"])
+                text = data.get("response", "")
+                if text:
+                    yield text
+                if data.get("done"):
+                    return
+    except Exception as exc:
+        _healthy_at.pop(host, None)
+        if isinstance(exc, LocalModelError):
+            raise
+        raise LocalModelError(str(exc)) from exc
+
+
+async def healthcheck(host: str, ttl: float = 30) -> bool:
+    """Return True if the local model service responds.
+
+    A healthy result is trusted for ``ttl`` seconds (or until generate()
+    fails); unhealthy hosts are re-probed on every call.
+    """
+    checked = _healthy_at.get(host)
+    if checked is not None and time.monotonic() - checked < ttl:
         return True
+    url = host.rstrip("/") + "/api/tags"
+    try:
+        await _request_json("GET", url, timeout=5)
     except Exception:
+        _healthy_at.pop(host, None)
         return False
+    _healthy_at[host] = time.monotonic()
+    return True
 
 
 def default_model() -> str:
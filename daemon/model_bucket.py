@@ -5,20 +5,69 @@ Creates custom API endpoints and model IDs for loaded models
 """
 
 import os
+import re
+import sys
 import json
+import mmap
+import time
+import shutil
+import struct
 import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass, asdict
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+from dataclasses import dataclass, field
 import logging
 
 logger = logging.getLogger("model_bucket")
 
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, indent=2).encode()
+
+    _loads = json.loads
+
 MODELS_DIR = Path.home() / "EDEN" / "models"
 MODELS_DIR.mkdir(parents=True, exist_ok=True)
 REGISTRY_FILE = MODELS_DIR / "registry.json"
 
-@dataclass
+GENERATE_CACHE_SIZE = 128  # Remembered generate() results
+GENERATE_CACHE_MAX_TEMP = 0.3  # Hotter sampling is meant to vary; never cached
+
+# A list, not a tuple: llama-cpp-python drops stop values that aren't str or list
+_STOP = ["</s>", "Human:", "User:", "\n\n\n"]
+_ROLE_PREFIX = {"system": "System: ", "user": "Human: ", "assistant": "Assistant: "}
+
+# Filename substrings -> capability or context length. Substring (not token)
+# matching so "codellama" still counts as code.
+_CAPABILITIES = ("code", "instruction", "vision", "embedding")
+_KEYWORDS = {
+    "code": ("cap", "code"),  # Also matches "coder"
+    "instruct": ("cap", "instruction"),
+    "vision": ("cap", "vision"),
+    "llava": ("cap", "vision"),
+    "embed": ("cap", "embedding"),
+    "128k": ("ctx", 131072),
+    "32k": ("ctx", 32768),
+    "16k": ("ctx", 16384),
+    "8k": ("ctx", 8192),
+}
+# One alternation over every keyword; the lookahead reports overlapping hits
+# ("128k" and the "8k" inside it) in a single left-to-right scan
+_KEYWORD_RE = re.compile("(?=(%s))" % "|".join(
+    map(re.escape, sorted(_KEYWORDS, key=len, reverse=True))
+))
+
+# slots keep large registries small; the flag only exists on 3.10+
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
 class ModelInfo:
     model_id: str
     filename: str
@@ -27,95 +76,251 @@ class ModelInfo:
     capabilities: List[str]
     context_length: int
     loaded: bool = False
+    created: int = field(default_factory=lambda: int(time.time()))
+    arch: Optional[str] = None  # general.architecture from the GGUF header
+
+# Persisted ModelInfo fields; "loaded" is runtime state and is left out
+_FIELDS = ("model_id", "filename", "path", "size_bytes", "capabilities",
+           "context_length", "created", "arch")
+
+def _to_dict(info: ModelInfo) -> Dict[str, Any]:
+    return {f: getattr(info, f) for f in _FIELDS}
+
+# ((st_mtime_ns, st_size), parsed JSON) of REGISTRY_FILE as last read or written
+_registry_cache: Optional[Tuple[Tuple[int, int], Dict[str, Any]]] = None
+
+_Llama = None
+
+def _get_llama():
+    """Import llama_cpp.Llama on first use only; the extension is heavy"""
+    global _Llama
+    if _Llama is None:
+        from llama_cpp import Llama
+        _Llama = Llama
+    return _Llama
+
+def _pick_text(response: Dict[str, Any]) -> str:
+    """Text of the first choice in a llama.cpp completion (or stream chunk)"""
+    return response['choices'][0]['text']
+
+def _copy_model(src: Path, dst: Path):
+    """Copy a GGUF into the bucket in-kernel (a reflink on btrfs/XFS) when possible"""
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                remaining = os.fstat(fin.fileno()).st_size
+                while remaining > 0:
+                    n = os.copy_file_range(fin.fileno(), fout.fileno(), min(remaining, 1 << 30))
+                    if n == 0:
+                        break
+                    remaining -= n
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            pass  # Old kernel or cross-filesystem copy it refuses; do it in userspace
+    shutil.copy2(src, dst)
+
+def _physical_cores() -> int:
+    """Physical CPU cores this process may run on; SMT siblings add little to
+    llama.cpp's matmul threads"""
+    try:
+        cpus = os.sched_getaffinity(0)
+    except AttributeError:  # Not Linux
+        cpus = range(os.cpu_count() or 1)
+    try:
+        # Each physical core lists the same siblings for all of its threads
+        return len({
+            Path(f"/sys/devices/system/cpu/cpu{n}/topology/thread_siblings_list").read_text()
+            for n in cpus
+        }) or 1
+    except OSError:
+        pass
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return min(cores, len(cpus))
+    except ImportError:
+        pass
+    return len(cpus) or 1  # No topology info: use every CPU we are allowed on
+
+# GGUF metadata value types with a fixed size (8 = string, 9 = array)
+_GGUF_SCALARS = {
+    0: struct.Struct("<B"), 1: struct.Struct("<b"), 2: struct.Struct("<H"),
+    3: struct.Struct("<h"), 4: struct.Struct("<I"), 5: struct.Struct("<i"),
+    6: struct.Struct("<f"), 7: struct.Struct("<?"), 10: struct.Struct("<Q"),
+    11: struct.Struct("<q"), 12: struct.Struct("<d"),
+}
+
+def _gguf_str(buf, pos: int) -> Tuple[str, int]:
+    (n,) = struct.unpack_from("<Q", buf, pos)
+    return buf[pos + 8:pos + 8 + n].decode(), pos + 8 + n
+
+def _gguf_skip(buf, pos: int, vtype: int) -> int:
+    """Offset just past a metadata value of the given type"""
+    if vtype in _GGUF_SCALARS:
+        return pos + _GGUF_SCALARS[vtype].size
+    if vtype == 8:
+        return _gguf_str(buf, pos)[1]
+    if vtype == 9:
+        etype, count = struct.unpack_from("<IQ", buf, pos)
+        pos += 12
+        if etype in _GGUF_SCALARS:
+            return pos + count * _GGUF_SCALARS[etype].size
+        for _ in range(count):
+            pos = _gguf_skip(buf, pos, etype)
+        return pos
+    raise ValueError(f"Unknown GGUF value type {vtype}")
+
+def _read_gguf_header(path: Path) -> Dict[str, Any]:
+    """Version, tensor count and architecture of a GGUF file ({} if it isn't one).
+
+    The file is memory-mapped, so only the header pages are read from disk.
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:4] != b"GGUF":
+                return {}
+            version, tensor_count, kv_count = struct.unpack_from("<IQQ", buf, 4)
+            header = {"version": version, "tensor_count": tensor_count}
+            if version < 2:
+                return header  # v1 used 32-bit counts; long obsolete
+            pos = 24
+            for _ in range(min(kv_count, 64)):  # general.* keys come first
+                key, pos = _gguf_str(buf, pos)
+                (vtype,) = struct.unpack_from("<I", buf, pos)
+                pos += 4
+                if key == "general.architecture" and vtype == 8:
+                    header["arch"] = _gguf_str(buf, pos)[0]
+                    break
+                pos = _gguf_skip(buf, pos, vtype)
+            return header
+    except (OSError, ValueError, struct.error):
+        return {}
+
+def _gpu_layers() -> int:
+    """Layers to offload to the GPU (EDEN_GPU_LAYERS, else all if llama.cpp has a GPU backend)"""
+    override = os.getenv("EDEN_GPU_LAYERS")
+    if override is not None:
+        return int(override)
+    try:
+        import llama_cpp
+        return -1 if llama_cpp.llama_supports_gpu_offload() else 0
+    except (ImportError, AttributeError):
+        return 0
 
 class ModelBucket:
     """Manage local GGUF models with custom IDs"""
 
     def __init__(self):
         self.registry: Dict[str, ModelInfo] = {}
+        self._by_filename: Dict[str, str] = {}  # filename -> model_id
         self.loaded_model = None
         self.loaded_model_id = None
         self.llm = None
+        self._lock = threading.RLock()  # llama.cpp contexts are not thread-safe
+        self.version = 0  # Bumped whenever model metadata changes
+        self._gen_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._gen_cache_lock = threading.Lock()
         self._load_registry()
 
     def _load_registry(self):
-        if REGISTRY_FILE.exists():
-            with open(REGISTRY_FILE) as f:
-                data = json.load(f)
-                for mid, info in data.items():
-                    self.registry[mid] = ModelInfo(**info)
+        global _registry_cache
+        try:
+            st = REGISTRY_FILE.stat()
+        except FileNotFoundError:
+            return
+        signature = (st.st_mtime_ns, st.st_size)
+        if _registry_cache is None or _registry_cache[0] != signature:
+            with open(REGISTRY_FILE, 'rb') as f:
+                _registry_cache = (signature, _loads(f.read()))
+        for mid, info in _registry_cache[1].items():
+            # Only known keys: older files carry "loaded" and may lack "created"
+            self.registry[mid] = ModelInfo(**{f: info[f] for f in _FIELDS if f in info})
+            self._by_filename[info["filename"]] = mid
 
     def _save_registry(self):
-        with open(REGISTRY_FILE, 'w') as f:
-            json.dump({k: asdict(v) for k, v in self.registry.items()}, f, indent=2)
-
-    def _generate_model_id(self, filename: str) -> str:
-        """Generate unique model ID from filename"""
-        # Extract model name from filename
-        name = filename.replace('.gguf', '').replace('-', '_').lower()
-        # Create short hash
-        hash_part = hashlib.sha256(filename.encode()).hexdigest()[:6]
-        return f"eden_{name}_{hash_part}"
-
-    def _detect_capabilities(self, filename: str) -> List[str]:
-        """Detect model capabilities from filename"""
-        caps = ["chat", "completion"]
+        """Atomically rewrite the registry file, skipping no-op writes"""
+        global _registry_cache
+        data = {k: _to_dict(v) for k, v in self.registry.items()}
+        if _registry_cache is not None and _registry_cache[1] == data and REGISTRY_FILE.exists():
+            return
+        tmp_path = REGISTRY_FILE.with_suffix(".json.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(_dumps(data))
+        os.replace(tmp_path, REGISTRY_FILE)
+        st = REGISTRY_FILE.stat()
+        _registry_cache = ((st.st_mtime_ns, st.st_size), data)
+
+    def _ingest(self, filename: str) -> Tuple[str, List[str], int]:
+        """Derive (model ID, capabilities, context length) from a filename"""
         fname_lower = filename.lower()
 
-        if "code" in fname_lower or "coder" in fname_lower:
-            caps.append("code")
-        if "instruct" in fname_lower:
-            caps.append("instruction")
-        if "vision" in fname_lower or "llava" in fname_lower:
-            caps.append("vision")
-        if "embed" in fname_lower:
-            caps.append("embedding")
-
-        return caps
-
-    def _detect_context_length(self, filename: str) -> int:
-        """Estimate context length from filename"""
-        fname_lower = filename.lower()
-        if "32k" in fname_lower:
-            return 32768
-        if "16k" in fname_lower:
-            return 16384
-        if "8k" in fname_lower:
-            return 8192
-        if "128k" in fname_lower:
-            return 131072
-        return 4096  # Default
-
-    def add_model(self, filepath: str) -> ModelInfo:
-        """Add a GGUF model to the bucket"""
+        # ID: model name from the filename plus a short hash
+        name = fname_lower.replace('.gguf', '').replace('-', '_')
+        hash_part = hashlib.blake2b(filename.encode(), digest_size=3).hexdigest()
+        model_id = f"eden_{name}_{hash_part}"
+
+        # Capabilities and context length in one pass
+        found = set()
+        context_length = 4096  # Default
+        for match in _KEYWORD_RE.finditer(fname_lower):
+            kind, value = _KEYWORDS[match.group(1)]
+            if kind == "cap":
+                found.add(value)
+            else:
+                context_length = max(context_length, value)
+        caps = ["chat", "completion"] + [c for c in _CAPABILITIES if c in found]
+        return model_id, caps, context_length
+
+    def add_model(self, filepath: str, save: bool = True,
+                  stat_result: Optional[os.stat_result] = None) -> ModelInfo:
+        """Add a GGUF model to the bucket.
+
+        save=False leaves the registry write to the caller; stat_result is the
+        file's stat when the caller already has it (saves a syscall).
+        """
         path = Path(filepath)
-        if not path.exists():
+        if stat_result is None and not path.exists():
             raise FileNotFoundError(f"Model not found: {filepath}")
 
         filename = path.name
-        model_id = self._generate_model_id(filename)
+        # Keep the ID of an already registered file (IDs minted before the
+        # hash change stay valid); only new files get a fresh one
+        new_id, caps, context_length = self._ingest(filename)
+        model_id = self._by_filename.get(filename) or new_id
 
         # Copy to models dir if not already there
         target_path = MODELS_DIR / filename
         if path != target_path and not target_path.exists():
-            import shutil
-            shutil.copy2(path, target_path)
+            _copy_model(path, target_path)
+
+        if stat_result is None or path != target_path:
+            stat_result = target_path.stat()
 
         info = ModelInfo(
             model_id=model_id,
             filename=filename,
             path=str(target_path),
-            size_bytes=target_path.stat().st_size,
-            capabilities=self._detect_capabilities(filename),
-            context_length=self._detect_context_length(filename),
-            loaded=False
+            size_bytes=stat_result.st_size,
+            capabilities=caps,
+            context_length=context_length,
+            loaded=False,
+            arch=_read_gguf_header(target_path).get("arch")
         )
 
         self.registry[model_id] = info
-        self._save_registry()
+        self._by_filename[filename] = model_id
+        self.version += 1
+        if save:
+            self._save_registry()
         logger.info(f"Added model: {model_id}")
         return info
 
+    def flush(self):
+        """Write pending registry changes to disk"""
+        self._save_registry()
+
     def list_models(self) -> List[ModelInfo]:
         """List all registered models"""
         return list(self.registry.values())
@@ -132,24 +337,40 @@ class ModelBucket:
             return False
 
         try:
-            from llama_cpp import Llama
-
-            # Unload previous model
-            if self.llm:
-                del self.llm
-                self.llm = None
-
-            logger.info(f"Loading model: {model_id}")
-            self.llm = Llama(
-                model_path=info.path,
-                n_ctx=min(info.context_length, 4096),  # Limit for memory
-                n_threads=4,
-                verbose=False
-            )
-
-            self.loaded_model_id = model_id
-            info.loaded = True
-            self._save_registry()
+            Llama = _get_llama()
+
+            with self._lock:
+                if model_id == self.loaded_model_id and self.llm is not None:
+                    return True  # Already resident; keep its warm KV cache
+
+                # Unload previous model; close() frees it now rather than at
+                # the next GC, so two models never sit in RAM together
+                if self.llm:
+                    if hasattr(self.llm, "close"):
+                        self.llm.close()
+                    del self.llm
+                    self.llm = None
+                    previous = self.registry.get(self.loaded_model_id)
+                    if previous:
+                        previous.loaded = False
+                    self.loaded_model_id = None
+
+                logger.info(f"Loading model: {model_id}")
+                threads = _physical_cores()
+                self.llm = Llama(
+                    model_path=info.path,
+                    n_ctx=min(info.context_length, 4096),  # Limit for memory
+                    n_threads=threads,
+                    n_threads_batch=threads,
+                    n_batch=512,
+                    use_mmap=True,
+                    n_gpu_layers=_gpu_layers(),
+                    verbose=False
+                )
+
+                self.loaded_model_id = model_id
+                info.loaded = True
+                self.version += 1
             logger.info(f"Model loaded: {model_id}")
             return True
 
@@ -157,61 +378,105 @@ class ModelBucket:
             logger.error(f"Failed to load model: {e}")
             return False
 
+    def _stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        with self._lock:
+            for chunk in self.llm(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=_STOP,
+                stream=True
+            ):
+                yield _pick_text(chunk)
+
     def generate(self, prompt: str, max_tokens: int = 256, temperature: float = 0.7) -> str:
         """Generate text using loaded model"""
         if not self.llm:
             return "[ERROR: No model loaded]"
 
+        key = None
+        if temperature <= GENERATE_CACHE_MAX_TEMP:
+            digest = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+            key = (self.loaded_model_id, digest, max_tokens, round(temperature, 3))
+            with self._gen_cache_lock:
+                text = self._gen_cache.get(key)
+                if text is not None:
+                    self._gen_cache.move_to_end(key)
+                    return text
+
         try:
-            response = self.llm(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                stop=["</s>", "Human:", "User:", "\n\n\n"]
-            )
-            return response['choices'][0]['text'].strip()
+            text = "".join(self._stream(prompt, max_tokens, temperature)).strip()
         except Exception as e:
             return f"[ERROR: {e}]"
 
-    def chat(self, messages: List[Dict], max_tokens: int = 256) -> str:
-        """Chat completion using loaded model"""
+        if key is not None:
+            with self._gen_cache_lock:
+                self._gen_cache[key] = text
+                if len(self._gen_cache) > GENERATE_CACHE_SIZE:
+                    self._gen_cache.popitem(last=False)
+        return text
+
+    def generate_stream(self, prompt: str, max_tokens: int = 256,
+                        temperature: float = 0.7) -> Iterator[str]:
+        """Yield generated text piece by piece as the loaded model produces it"""
         if not self.llm:
-            return "[ERROR: No model loaded]"
+            yield "[ERROR: No model loaded]"
+            return
+
+        try:
+            yield from self._stream(prompt, max_tokens, temperature)
+        except Exception as e:
+            yield f"[ERROR: {e}]"
 
-        # Format messages into prompt
-        prompt = ""
+    def _chat_prompt(self, messages: List[Dict]) -> str:
+        """Format messages into prompt"""
+        parts = []
         for msg in messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            if role == "system":
-                prompt += f"System: {content}\n\n"
-            elif role == "user":
-                prompt += f"Human: {content}\n\n"
-            elif role == "assistant":
-                prompt += f"Assistant: {content}\n\n"
+            prefix = _ROLE_PREFIX.get(msg.get("role", "user"))
+            if prefix is not None:  # Unknown roles are left out
+                parts += (prefix, msg.get("content", ""), "\n\n")
+        parts.append("Assistant:")
+        return "".join(parts)
 
-        prompt += "Assistant:"
+    def chat(self, messages: List[Dict], max_tokens: int = 256, temperature: float = 0.7) -> str:
+        """Chat completion using loaded model"""
+        if not self.llm:
+            return "[ERROR: No model loaded]"
+        return self.generate(self._chat_prompt(messages), max_tokens, temperature)
 
-        return self.generate(prompt, max_tokens)
+    def chat_stream(self, messages: List[Dict], max_tokens: int = 256,
+                    temperature: float = 0.7) -> Iterator[str]:
+        """Streaming chat completion using loaded model"""
+        return self.generate_stream(self._chat_prompt(messages), max_tokens, temperature)
 
     def scan_directory(self, directory: str = None) -> List[ModelInfo]:
         """Scan directory for GGUF files and add them"""
         scan_dir = Path(directory) if directory else MODELS_DIR
         added = []
 
-        for gguf_file in scan_dir.glob("*.gguf"):
-            if gguf_file.name not in [m.filename for m in self.registry.values()]:
-                info = self.add_model(str(gguf_file))
-                added.append(info)
+        with os.scandir(scan_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if (name.endswith(".gguf") and not name.startswith(".")
+                        and name not in self._by_filename and entry.is_file()):
+                    info = self.add_model(entry.path, save=False, stat_result=entry.stat())
+                    added.append(info)
 
+        if added:
+            self._save_registry()
         return added
 
 
 # Singleton instance
 _bucket = None
+_bucket_lock = threading.Lock()
 
 def get_bucket() -> ModelBucket:
     global _bucket
-    if _bucket is None:
-        _bucket = ModelBucket()
-    return _bucket
+    bucket = _bucket
+    if bucket is not None:
+        return bucket  # Fast path: no lock once created
+    with _bucket_lock:
+        if _bucket is None:
+            _bucket = ModelBucket()
+        return _bucket
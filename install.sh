@@ -27,7 +27,7 @@ echo "  ✓ Node.js found: $(node --version)"
 
 # Install Python dependencies
 echo "[3/5] Installing Python dependencies..."
-pip3 install --user aiohttp 2>/dev/null || true
+pip3 install --user aiohttp orjson uvloop 2>/dev/null || true
 echo "  ✓ Python deps installed"
 
 # Install Node dependencies
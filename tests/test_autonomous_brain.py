@@ -0,0 +1,51 @@
+"""autonomous_brain must import and think locally both as daemon.autonomous_brain
+and as a top-level module with daemon/ on sys.path (how gesher_el.py runs)."""
+
+import sys
+import types
+import asyncio
+import importlib
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+DAEMON = ROOT / "daemon"
+
+
+class FakeBucket:
+    def generate(self, prompt, max_tokens=256, temperature=0.7):
+        return f"local:{prompt}:{max_tokens}"
+
+
+def _fake_model_bucket():
+    # Stands in for model_bucket, which creates ~/EDEN/models on import
+    module = types.ModuleType("model_bucket")
+    module.get_bucket = FakeBucket
+    return module
+
+
+class ThinkLocalTest(unittest.TestCase):
+    def _think_local(self, module_name, path_entry, bucket_name):
+        others = [p for p in sys.path if Path(p or ".").resolve() not in (ROOT, DAEMON)]
+        with mock.patch.object(sys, "path", [str(path_entry)] + others), \
+                mock.patch.dict(sys.modules):
+            for name in ("daemon", "daemon.autonomous_brain", "daemon.common",
+                         "autonomous_brain", "common"):
+                sys.modules.pop(name, None)
+            sys.modules[bucket_name] = _fake_model_bucket()
+            brain_module = importlib.import_module(module_name)
+            brain = brain_module.AutonomousBrain(soul_state=None, thought_stream=None)
+            return asyncio.run(brain._think_local("hello"))
+
+    def test_package_import(self):
+        reply = self._think_local("daemon.autonomous_brain", ROOT, "daemon.model_bucket")
+        self.assertEqual(reply, "local:hello:512")
+
+    def test_script_import(self):
+        reply = self._think_local("autonomous_brain", DAEMON, "model_bucket")
+        self.assertEqual(reply, "local:hello:512")
+
+
+if __name__ == "__main__":
+    unittest.main()
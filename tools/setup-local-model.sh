@@ -2,6 +2,7 @@
 set -euo pipefail
 
 MODEL_NAME="${EDEN_MODEL_NAME:-qwen2.5-coder:7b}"
+PARALLEL="${EDEN_MODEL_PARALLEL:-4}"
 
 if ! command -v ollama >/dev/null 2>&1; then
   echo "Installing Ollama..."
@@ -9,7 +10,18 @@ if ! command -v ollama >/dev/null 2>&1; then
 fi
 
 if command -v systemctl >/dev/null 2>&1; then
-  systemctl enable --now ollama || true
+  # Let Ollama batch concurrent daemon requests (intent/ask/autonomous) together.
+  # Restart only when the drop-in was written (needs root); otherwise leave a
+  # running server alone.
+  if mkdir -p /etc/systemd/system/ollama.service.d 2>/dev/null \
+    && printf '[Service]\nEnvironment="OLLAMA_NUM_PARALLEL=%s"\n' "${PARALLEL}" \
+      2>/dev/null > /etc/systemd/system/ollama.service.d/eden.conf; then
+    systemctl daemon-reload || true
+    systemctl enable ollama || true
+    systemctl restart ollama || true
+  else
+    systemctl enable --now ollama || true
+  fi
 fi
 
 echo "Pulling model: ${MODEL_NAME}"
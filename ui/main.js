@@ -15,19 +15,30 @@ let daemonProcess = null;
 // ============ DAEMON COMMUNICATION ============
 function sendToDaemon(cmd) {
     return new Promise((resolve, reject) => {
+        // Frames are a 4-byte big-endian length followed by the JSON body
         const client = net.createConnection(SOCKET_PATH, () => {
-            client.write(JSON.stringify(cmd));
+            const payload = Buffer.from(JSON.stringify(cmd));
+            const header = Buffer.alloc(4);
+            header.writeUInt32BE(payload.length);
+            client.write(Buffer.concat([header, payload]));
         });
 
-        let data = '';
-        client.on('data', (chunk) => { data += chunk; });
-        client.on('end', () => {
+        let data = Buffer.alloc(0);
+        let done = false;
+        client.on('data', (chunk) => {
+            data = Buffer.concat([data, chunk]);
+            if (data.length < 4 || data.length < 4 + data.readUInt32BE(0)) return;
+            done = true;
+            client.end();
             try {
-                resolve(JSON.parse(data));
+                resolve(JSON.parse(data.subarray(4, 4 + data.readUInt32BE(0)).toString('utf8')));
             } catch (e) {
                 reject(e);
             }
         });
+        client.on('end', () => {
+            if (!done) reject(new Error('Daemon closed the connection'));
+        });
         client.on('error', reject);
     });
 }